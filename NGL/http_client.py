@@ -0,0 +1,74 @@
+import asyncio
+import ssl
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+
+class HttpError(Exception):
+    """ response with an unexpected HTTP status """
+
+    def __init__(self, status, body=b''):
+        super().__init__('HTTP {0}'.format(status))
+        self.status = status
+        self.body = body
+
+
+async def _read_body(reader, headers, read_timeout):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), read_timeout)
+            size = int(size_line.split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                await asyncio.wait_for(reader.readline(), read_timeout)
+                return b''.join(chunks)
+            chunks.append(await asyncio.wait_for(reader.readexactly(size), read_timeout))
+            await asyncio.wait_for(reader.readexactly(2), read_timeout)
+    if 'content-length' in headers:
+        return await asyncio.wait_for(reader.readexactly(int(headers['content-length'])), read_timeout)
+    return await asyncio.wait_for(reader.read(), read_timeout)
+
+
+async def request(url, method='GET', headers=None, body=None, connect_timeout=3, read_timeout=5):
+    """ HTTP/1.1 request over asyncio with separate connect and read timeouts """
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None),
+        connect_timeout)
+    try:
+        lines = ['{0} {1} HTTP/1.1'.format(method, path),
+                 'Host: {0}'.format(parts.netloc),
+                 'Connection: close']
+        for name, value in (headers or {}).items():
+            lines.append('{0}: {1}'.format(name, value))
+        if body is not None:
+            lines.append('Content-Length: {0}'.format(len(body)))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await asyncio.wait_for(writer.drain(), read_timeout)
+
+        status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+        if not status_line:
+            raise ConnectionError('connection closed before response')
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), read_timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if status in (204, 304) or method == 'HEAD':
+            return Response(status, response_headers, b'')
+        return Response(status, response_headers, await _read_body(reader, response_headers, read_timeout))
+    finally:
+        writer.close()
@@ -0,0 +1,74 @@
+import asyncio
+import json
+from urllib.parse import parse_qs, urlsplit
+
+STATUS_TEXT = {200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+               401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def json_response(status, obj, headers=None):
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    return status, headers, json.dumps(obj).encode()
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def _read_request(reader, max_body_size):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    # checked before reading, the body is only allocated when it fits
+    length = int(headers.get('content-length', 0))
+    if length > max_body_size:
+        raise BodyTooLarge()
+    body = await reader.readexactly(length)
+    parts = urlsplit(target)
+    return method, parts.path, parse_qs(parts.query), headers, body
+
+
+async def start_server(handler, host, port, read_timeout=10, max_body_size=65536):
+    """ minimal asyncio HTTP/1.1 server, handler(method, path, query, headers, body)
+    returns (status, headers, body); request bodies above max_body_size get 413 """
+
+    async def handle(reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(_read_request(reader, max_body_size), read_timeout)
+            except BodyTooLarge:
+                status, headers, body = 413, {}, b''
+            else:
+                if request is None:
+                    return
+                try:
+                    status, headers, body = await handler(*request)
+                except Exception as e:
+                    print(e)
+                    status, headers, body = 500, {}, b''
+
+            lines = ['HTTP/1.1 {0} {1}'.format(status, STATUS_TEXT.get(status, '')),
+                     'Connection: close']
+            lines += ['{0}: {1}'.format(name, value) for name, value in headers.items()]
+            if status not in (204, 304):
+                lines.append('Content-Length: {0}'.format(len(body)))
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            # server shutting down while a (long-poll) request is held, nothing awaits this task
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,14 +1,45 @@
+import asyncio
+import hashlib
+import ipaddress
+import os
 import sqlite3
 import time
 import json
-import urllib.request
 from gpiozero import LED
+import http_client
+import http_server
+from telemetry import TelemetryBuffer, TelemetryUploader
 
-CONTROLLER_ID = 'AB2EW'
+CONTROLLER_ID = os.getenv('CONTROLLER_ID', 'AB2EW')
 DB_NAME = "slamp-{0}.db".format(CONTROLLER_ID)
-APPL_URL = "http://10.10.1.86:8001/slamp"
+APPL_URL = os.getenv('SLAMP_URL', "http://10.10.1.86:8001/slamp")
 API_URL = "{0}/api/controller/{1}.do".format(APPL_URL, CONTROLLER_ID)
+# push mode: long-poll PUSH_URL, the server answers as soon as the config changes;
+# falls back to polling API_URL while the push channel is unavailable
+PUSH_MODE = os.getenv('PUSH_MODE', '0') == '1'
+PUSH_URL = "{0}/api/controller/{1}/watch.do".format(APPL_URL, CONTROLLER_ID)
+LONG_POLL_TIMEOUT = 30 # in second, how long the server may hold a push request
+PUSH_RETRY_AFTER = 60 # in second, polling period before the push channel is retried
 REFRESH_RATE = 5 # in second
+CONNECT_TIMEOUT = 3 # in second
+READ_TIMEOUT = 5 # in second
+# local status/override API, STATUS_PORT=0 disables it; when STATUS_TOKEN is set,
+# overrides need an "Authorization: Bearer <token>" header. Bound to loopback by default,
+# on any other STATUS_HOST /override is refused unless STATUS_TOKEN is set
+STATUS_HOST = os.getenv('STATUS_HOST', '127.0.0.1')
+STATUS_PORT = int(os.getenv('STATUS_PORT', '8080'))
+STATUS_TOKEN = os.getenv('STATUS_TOKEN')
+STATUS_MAX_BODY = 4096 # in bytes, larger request bodies are answered with 413 unread
+# lamp switches, online/offline changes and periodic health are buffered in SQLite
+# (at most TELEMETRY_MAX_EVENTS rows) and uploaded gzip-compressed to TELEMETRY_URL
+TELEMETRY_MODE = os.getenv('TELEMETRY', '1') == '1'
+TELEMETRY_URL = "{0}/api/controller/{1}/telemetry.do".format(APPL_URL, CONTROLLER_ID)
+TELEMETRY_INTERVAL = 60 # in second, flush to SQLite and upload
+HEALTH_INTERVAL = 300 # in second
+TELEMETRY_MAX_EVENTS = 10000
+TELEMETRY_BATCH = 500
+TELEMETRY_MAX_BACKOFF = 3600 # in second
+MAX_SCHEDULE_SLEEP = 60 # in second, re-check the clock at least this often (NTP jumps at boot)
 
 sql_config_table = """CREATE TABLE IF NOT EXISTS config(
 pin integer primary key,
@@ -16,50 +47,64 @@ time_start text not null,
 time_end text not null,
 lamp_stat integer not null);"""
 
-ledstat = {}
-led = {}
+NUM_PINS = 54 # BCM GPIO 0-53
+PIN_UNKNOWN = 2
 
-# kode yang lama, pakai ledstat
-def turn_on_lamp(pin):
-    if pin in ledstat:
-        if ledstat[pin] == 0:
-            ledstat[pin] = 1
-            led[pin].on() # print('turn on pin {0}'.format(pin)) 
-    else:
-        ledstat[pin] = 1
-        led[pin] = LED(pin) # print('set led pin of {0}'.format(pin))
-        led[pin].on() # print('turn on pin {0}'.format(pin))
-
-# kode yang baru, pakai led.is_lit
-def turn_on_lamp_new(pin):
-    if pin in led and not led[pin].is_lit:
-        led[pin].on()
-    elif pin not in led:
-        led[pin] = LED(pin)
-        led[pin].on()
-
-def turn_off_lamp(pin):
-    if pin in ledstat:
-        if ledstat[pin] == 1:
-            ledstat[pin] = 0
-            led[pin].off() # print('turn off pin {0}'.format(pin)) 
-    else:
-        ledstat[pin] = 0
-        led[pin] = LED(pin) # print('set led pin of {0}'.format(pin))
-        led[pin].off() # print('turn off pin {0}'.format(pin)) 
 
-def turn_off_lamp_new(pin):
-    if pin in led and led[pin].is_lit:
-        led[pin].off()
-    elif pin not in led:
-        led[pin] = LED(pin)
-        led[pin].off()
+def make_pin_factory(name=None):
+    """ gpiozero pin factory by name, 'mock' runs without a Raspberry Pi """
+    if name == 'mock':
+        from gpiozero.pins.mock import MockFactory
+        return MockFactory()
+    # None lets gpiozero pick, GPIOZERO_PIN_FACTORY=mock also works for a single runner
+    return None
+
+
+class PinTable:
+    """ desired and applied lamp state per BCM pin, only the difference is written to GPIO """
+
+    def __init__(self, pin_factory=None):
+        self.pin_factory = pin_factory
+        self.desired = bytearray([PIN_UNKNOWN]) * NUM_PINS
+        self.applied = bytearray([PIN_UNKNOWN]) * NUM_PINS
+        self.leds = [None] * NUM_PINS
+        self.switch_count = 0
+
+    def set(self, pin, lamp_on):
+        if not 0 <= pin < NUM_PINS:
+            print('Invalid pin {0}'.format(pin))
+            return
+        self.desired[pin] = 1 if lamp_on else 0
+
+    def commit(self):
+        """ switch the pins whose desired state differs from the applied one, returns (pin, state) """
+        transitions = [(pin, state) for pin, (state, applied) in enumerate(zip(self.desired, self.applied))
+                       if state != PIN_UNKNOWN and state != applied]
+        for pin, state in transitions:
+            if self.leds[pin] is None:
+                self.leds[pin] = LED(pin, pin_factory=self.pin_factory)
+            if state:
+                self.leds[pin].on()
+            else:
+                self.leds[pin].off()
+            self.applied[pin] = state
+        self.switch_count += len(transitions)
+        return transitions
+
+    def state(self):
+        """ pin -> lamp on for every pin that has been switched """
+        return {pin: bool(state) for pin, state in enumerate(self.applied) if state != PIN_UNKNOWN}
+
 
 def create_connection(db_file):
     """ create a databse connection to a SQLite databse """
     conn = None
     try:
         conn = sqlite3.connect(db_file)
+        # WAL + synchronous=NORMAL: one fsync per checkpoint instead of per commit,
+        # the SD card on the Pi is the bottleneck
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
         print('Connected to SQLite Database : {0}'.format(sqlite3.version))
     except Exception as e:
         print(e)
@@ -76,16 +121,13 @@ def execute_query(conn, sql):
         print(e)
 
 
-def insert_config_data(conn, data):
-    ins = '''INSERT INTO config(time_start,time_end,lamp_stat,pin) values(?,?,?,?)'''
-    upd = '''UPDATE config SET time_start=?,time_end=?,lamp_stat=? WHERE pin=?'''
-    cur = conn.cursor()
-    try:
-        cur.execute(ins, data)
-    except sqlite3.IntegrityError:
-        cur.execute(upd, data)
-    finally:
-        conn.commit()
+def upsert_config_data(conn, rows):
+    """ insert or update (time_start, time_end, lamp_stat, pin) rows in one transaction """
+    sql = '''INSERT INTO config(time_start,time_end,lamp_stat,pin) values(?,?,?,?)
+    ON CONFLICT(pin) DO UPDATE SET time_start=excluded.time_start,
+    time_end=excluded.time_end, lamp_stat=excluded.lamp_stat'''
+    with conn:
+        conn.executemany(sql, rows)
 
 
 def fetch_data(conn):
@@ -100,55 +142,379 @@ def fetch_data(conn):
         return None
 
 
-def is_time_between(begin_time, end_time, check_time=None):
-    check_time = check_time or time.localtime()
-    return check_time >= begin_time and check_time <= end_time
-#    if begin_time < end_time:
-#        return check_time >= begin_time and check_time <= end_time
-#    else
-#        return check_time >= begin_time or check_time <= end_time
+def is_time_between(begin_time, end_time, check_time):
+    if begin_time <= end_time:
+        return check_time >= begin_time and check_time <= end_time
+    else:
+        # window crosses midnight, e.g. 18:00 - 06:00
+        return check_time >= begin_time or check_time <= end_time
 
 
-def is_time_between_str(begin, end, fmt='%H:%M'):
-    begin_time = time.strptime(begin, fmt)
-    end_time = time.strptime(end, fmt)
-    now_time = time.strptime(time.strftime(fmt), fmt)
-    return is_time_between(begin_time, end_time, now_time)
+def to_minutes(value, fmt='%H:%M'):
+    parsed = time.strptime(value, fmt)
+    return parsed.tm_hour * 60 + parsed.tm_min
 
 
-if __name__ == '__main__':
-    print('Runner Job Start on {0}'.format(
-        time.strftime('%a, %d-%m-%Y %H:%M:%S')))
-    conn = create_connection(DB_NAME)
-    execute_query(conn, sql_config_table)
-    while True:
-        try:
-            response = urllib.request.urlopen(API_URL).read().decode()
-            data = json.loads(response)
+class Schedule:
+    """ stored config compiled to minutes since midnight, rebuilt only when the config changes """
 
-            for obj in data:
-                if obj['isLampOn']:
-                    turn_on_lamp(obj['pin'])
-                else:
-                    turn_off_lamp(obj['pin'])
-                insert_config_data(conn, (obj['configTimeStart'], obj['configTimeEnd'], obj['configLampStatus'], obj['pin']))
+    DAY = 24 * 60
+
+    def __init__(self, rows):
+        self.entries = []
+        for pin, time_start, time_end, lamp_stat in rows:
+            try:
+                self.entries.append((pin, to_minutes(time_start), to_minutes(time_end), lamp_stat == 1))
+            except (TypeError, ValueError) as e:
+                print('Invalid schedule for pin {0}: {1}'.format(pin, e))
+
+    def desired(self, minute):
+        """ pin -> lamp on for the given minute since midnight """
+        state = {}
+        for pin, start, end, lamp_stat in self.entries:
+            # lamp_stat is the state inside the window, the opposite applies outside
+            state[pin] = is_time_between(start, end, minute) == lamp_stat
+        return state
+
+    def minutes_until_change(self, minute):
+        """ minutes until the next window edge, None for an empty schedule """
+        # the end minute is inclusive, so the state flips one minute after it
+        edges = {start for _, start, _, _ in self.entries} | \
+            {(end + 1) % self.DAY for _, _, end, _ in self.entries}
+        if not edges:
+            return None
+        return min((edge - minute) % self.DAY or self.DAY for edge in edges)
+
+
+class Controller:
+    """ asyncio lamp controller, the local schedule never waits on the network fetch """
+
+    def __init__(self, controller_id, db_name, api_url, refresh_rate=REFRESH_RATE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 push_url=None, long_poll_timeout=LONG_POLL_TIMEOUT, pin_factory=None,
+                 status_port=None, status_host=STATUS_HOST, status_token=None,
+                 telemetry_url=None, telemetry_interval=TELEMETRY_INTERVAL):
+        self.controller_id = controller_id
+        self.db_name = db_name
+        self.api_url = api_url
+        self.refresh_rate = refresh_rate
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.push_url = push_url
+        self.long_poll_timeout = long_poll_timeout
+        self.push_retry_at = 0
+        self.status_port = status_port
+        self.status_host = status_host
+        self.status_token = status_token
+        self.telemetry_url = telemetry_url
+        self.telemetry_interval = telemetry_interval
+        self.telemetry = None
+        self.uploader = None
+        self.started = time.monotonic()
+        self.offline_since = None # time.monotonic() of the first failed fetch
+        self.fetch_failures = 0 # since the last health event
+        self.pins = PinTable(pin_factory)
+        self.conn = None
+        self.last_sync = None # time.monotonic() of the last successful fetch
+        self.last_sync_time = None # time.time() of the last successful fetch, for the status API
+        self.fetch_latency = None # in second, last polled fetch
+        self.stale_after = refresh_rate * 2 # network state older than this is ignored
+        self.stored = {} # pin -> (time_start, time_end, lamp_stat) as saved in the database
+        self.schedule = Schedule([])
+        self.wakeup = None # asyncio.Event, created inside the running loop
+        self.reset_network_state()
+
+    def open(self):
+        self.wakeup = asyncio.Event()
+        self.conn = create_connection(self.db_name)
+        execute_query(self.conn, sql_config_table)
+        self.stored = {row[0]: tuple(row[1:]) for row in fetch_data(self.conn) or []}
+        self.rebuild_schedule()
+        self.telemetry = TelemetryBuffer(self.conn, TELEMETRY_MAX_EVENTS)
+        if self.telemetry_url:
+            self.uploader = TelemetryUploader(
+                self.telemetry, self.telemetry_url, self.controller_id, TELEMETRY_BATCH,
+                max_delay=TELEMETRY_MAX_BACKOFF, connect_timeout=self.connect_timeout)
+        self.telemetry.record('start', pins=len(self.stored))
+
+    def rebuild_schedule(self):
+        self.schedule = Schedule([(pin,) + config for pin, config in self.stored.items()])
+        self.wakeup.set()
+
+    def reset_network_state(self):
+        # validators and hashes of the last applied network config; cleared when the
+        # stored schedule takes over so the next response is applied in full
+        self.etag = None
+        self.last_modified = None
+        self.config_hash = None
+
+    def is_synced(self):
+        # network state is authoritative only while it is fresh
+        return self.last_sync is not None and \
+            time.monotonic() - self.last_sync < self.stale_after
+
+    async def fetch_config(self, url=None, read_timeout=None):
+        """ fetch the controller config, None when it did not change since the last fetch """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        response = await http_client.request(
+            url or self.api_url, headers=headers,
+            connect_timeout=self.connect_timeout, read_timeout=read_timeout or self.read_timeout)
+        if response.status == 304:
+            return None
+        if response.status != 200:
+            raise http_client.HttpError(response.status, response.body)
+
+        self.etag = response.headers.get('etag')
+        self.last_modified = response.headers.get('last-modified')
+        # servers without validators still send the same body when nothing changed
+        config_hash = hashlib.sha1(response.body).hexdigest()
+        if config_hash == self.config_hash:
+            return None
+        data = json.loads(response.body.decode())
+        self.config_hash = config_hash
+        return data
+
+    def apply_network_config(self, data):
+        # read every entry before touching the pins, a malformed config changes nothing
+        entries = [(obj['pin'], obj['isLampOn'],
+                    (obj['configTimeStart'], obj['configTimeEnd'], obj['configLampStatus'])) for obj in data]
+        rows = []
+        for pin, lamp_on, config in entries:
+            self.pins.set(pin, lamp_on)
+            if self.stored.get(pin) != config:
+                rows.append(config + (pin,))
+
+        transitions = self.commit_pins('network')
+        if rows:
+            self.save_config(rows)
+        if transitions or rows:
             print('Successfuly configured lamp by network configuration: {0}'.format(
                 time.strftime('%d-%m %H:%M:%S')))
-        except Exception as e:
-            # failed to fetch data from url
-            # fetch data from database
-            for row in fetch_data(conn):
-                if is_time_between_str(row[1], row[2]):
-                    if row[3] == 1:
-                        turn_on_lamp(row[0])
-                    else:
-                        turn_off_lamp(row[0])
+
+    def commit_pins(self, source):
+        transitions = self.pins.commit()
+        for pin, state in transitions:
+            self.telemetry.record('switch', pin=pin, on=bool(state), source=source)
+        return transitions
+
+    def save_config(self, rows):
+        """ persist (time_start, time_end, lamp_stat, pin) rows and rebuild the schedule """
+        upsert_config_data(self.conn, rows)
+        for row in rows:
+            self.stored[row[3]] = row[:3]
+        self.rebuild_schedule()
+
+    def apply_stored_config(self, now=None):
+        now = now or time.localtime()
+        self.reset_network_state()
+        for pin, lamp_on in self.schedule.desired(now.tm_hour * 60 + now.tm_min).items():
+            self.pins.set(pin, lamp_on)
+        self.commit_pins('stored')
+        print('Successfuly configured lamp by stored configuration: {0}'.format(
+            time.strftime('%d-%m %H:%M:%S')))
+
+    def use_push(self):
+        return self.push_url is not None and time.monotonic() >= self.push_retry_at
+
+    async def fetch_pushed_config(self):
+        """ long-poll the push channel, the server answers when the config changes """
+        self.stale_after = self.long_poll_timeout + self.read_timeout + self.refresh_rate
+        url = '{0}?timeout={1}'.format(self.push_url, self.long_poll_timeout)
+        return await self.fetch_config(url, self.long_poll_timeout + self.read_timeout)
+
+    async def sync_loop(self):
+        while True:
+            push = self.use_push()
+            started = time.monotonic()
+            try:
+                if push:
+                    data = await self.fetch_pushed_config()
                 else:
-                    if row[3] == 1:
-                        turn_off_lamp(row[0]) #led.off()
-                    else:
-                        turn_on_lamp(row[0]) #led.on()
-            print('Successfuly configured lamp by stored configuration: {0}'.format(
-                time.strftime('%d-%m %H:%M:%S')))
+                    self.stale_after = self.refresh_rate * 2
+                    data = await self.fetch_config()
+                    self.fetch_latency = time.monotonic() - started
+            except Exception as e:
+                if push:
+                    # push channel unavailable, poll API_URL until PUSH_RETRY_AFTER has passed
+                    self.push_retry_at = time.monotonic() + PUSH_RETRY_AFTER
+                    print('Push channel unavailable, falling back to polling: {0!r}'.format(e))
+                    self.wakeup.set()
+                    continue
+                # failed to fetch data from url, control_loop falls back to the database
+                if self.last_sync is not None:
+                    self.last_sync = None
+                    self.wakeup.set()
+                if self.offline_since is None:
+                    self.offline_since = time.monotonic()
+                    self.telemetry.record('offline', error=repr(e))
+                self.fetch_failures += 1
+                print('Failed to fetch network configuration: {0!r}'.format(e))
+            else:
+                try:
+                    if data is not None:
+                        self.apply_network_config(data)
+                except Exception as e:
+                    # malformed config, GPIO or SQLite failure: control_loop falls back to the
+                    # database and the cleared validators make the next response apply in full
+                    print('Failed to apply network configuration: {0!r}'.format(e))
+                    self.reset_network_state()
+                    if self.last_sync is not None:
+                        self.last_sync = None
+                        self.wakeup.set()
+                    await asyncio.sleep(self.refresh_rate)
+                    continue
+                if self.offline_since is not None:
+                    self.telemetry.record('online', outage_s=round(time.monotonic() - self.offline_since, 1))
+                    self.offline_since = None
+                self.last_sync = time.monotonic()
+                self.last_sync_time = time.time()
+                # subscribe again right away when the server pushed a change or held the
+                # request; an instant 304 means the server does not long-poll
+                if push and (data is not None or time.monotonic() - started >= 1):
+                    continue
+            await asyncio.sleep(self.refresh_rate)
+
+    def seconds_until_next_check(self):
+        if self.is_synced():
+            # wake up when the network state would become stale
+            return self.last_sync + self.stale_after - time.monotonic()
+        now = time.localtime()
+        minutes = self.schedule.minutes_until_change(now.tm_hour * 60 + now.tm_min)
+        if minutes is None:
+            return MAX_SCHEDULE_SLEEP
+        return min(minutes * 60 - now.tm_sec, MAX_SCHEDULE_SLEEP)
+
+    async def control_loop(self):
+        # sleep until the next schedule transition instead of polling, sync_loop and
+        # config changes wake this loop up through self.wakeup
+        while True:
+            self.wakeup.clear()
+            timeout = None
+            try:
+                if not self.is_synced():
+                    self.apply_stored_config()
+            except Exception as e:
+                # GPIO or database failure, keep running and retry after refresh_rate
+                print('Failed to configure lamp by stored configuration: {0!r}'.format(e))
+                timeout = self.refresh_rate
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout or max(self.seconds_until_next_check(), 0.1))
+            except asyncio.TimeoutError:
+                pass
+
+    def health(self):
+        health = {
+            'uptime_s': round(time.monotonic() - self.started),
+            'source': 'network' if self.is_synced() else 'stored',
+            'switch_count': self.pins.switch_count,
+            'fetch_failures': self.fetch_failures,
+            'fetch_latency_ms': round(self.fetch_latency * 1000, 1) if self.fetch_latency is not None else None,
+        }
+        self.fetch_failures = 0
+        return health
+
+    async def telemetry_loop(self):
+        next_health = time.monotonic()
+        while True:
+            if time.monotonic() >= next_health:
+                self.telemetry.record('health', **self.health())
+                next_health = time.monotonic() + HEALTH_INTERVAL
+            try:
+                if self.uploader:
+                    await self.uploader.tick()
+                else:
+                    self.telemetry.flush()
+            except Exception as e:
+                # a locked or failing database must not stop the lamps, telemetry is best effort
+                print('Failed to write telemetry: {0!r}'.format(e))
+            await asyncio.sleep(self.telemetry_interval)
+
+    def status(self):
+        return {
+            'controller_id': self.controller_id,
+            'source': 'network' if self.is_synced() else 'stored',
+            'push': self.use_push(),
+            'last_sync': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_sync_time))
+            if self.last_sync_time else None,
+            'fetch_latency_ms': round(self.fetch_latency * 1000, 1) if self.fetch_latency is not None else None,
+            'pins': {str(pin): lamp_on for pin, lamp_on in self.pins.state().items()},
+            'switch_count': self.pins.switch_count,
+            'telemetry_backlog': self.telemetry.count(),
+            'schedule': [{'pin': pin, 'time_start': config[0], 'time_end': config[1], 'lamp_stat': config[2]}
+                         for pin, config in sorted(self.stored.items())],
+        }
+
+    def override_allowed(self):
+        # without a token only a loopback bind keeps the LAN from rewriting the schedule
+        if self.status_token:
+            return True
+        try:
+            return ipaddress.ip_address(self.status_host).is_loopback
+        except ValueError:
+            return self.status_host == 'localhost'
+
+    def parse_override(self, body):
+        obj = json.loads(body.decode())
+        row = (str(obj['time_start']), str(obj['time_end']), int(obj['lamp_stat']), int(obj['pin']))
+        to_minutes(row[0])
+        to_minutes(row[1])
+        if row[2] not in (0, 1) or not 0 <= row[3] < NUM_PINS:
+            raise ValueError('lamp_stat must be 0 or 1 and pin a BCM GPIO number')
+        return row
+
+    async def handle_status_request(self, method, path, query, headers, body):
+        """ GET /status, POST /override {"pin", "time_start", "time_end", "lamp_stat"} """
+        if path == '/status':
+            if method != 'GET':
+                return 405, {}, b''
+            return http_server.json_response(200, self.status())
+
+        if path == '/override':
+            if method != 'POST':
+                return 405, {}, b''
+            if not self.override_allowed():
+                return http_server.json_response(403, {'error': 'set STATUS_TOKEN to allow overrides on {0}'.format(
+                    self.status_host)})
+            if self.status_token and headers.get('authorization') != 'Bearer {0}'.format(self.status_token):
+                return 401, {}, b''
+            try:
+                row = self.parse_override(body)
+            except (ValueError, KeyError, TypeError) as e:
+                return http_server.json_response(400, {'error': str(e)})
+            # stored schedule only, a later network config change for the pin replaces it
+            self.save_config([row])
+            print('Local override for pin {0}: {1}-{2} lamp_stat={3}'.format(row[3], row[0], row[1], row[2]))
+            return http_server.json_response(200, self.status())
+
+        return 404, {}, b''
+
+    async def run(self):
+        self.open()
+        server = None
+        if self.status_port:
+            server = await http_server.start_server(self.handle_status_request, self.status_host, self.status_port,
+                                                   max_body_size=STATUS_MAX_BODY)
+            print('Status API on {0}:{1}'.format(self.status_host, self.status_port))
+            if not self.override_allowed():
+                print('STATUS_TOKEN is not set, /override is disabled on {0}'.format(self.status_host))
+        try:
+            await asyncio.gather(self.sync_loop(), self.control_loop(), self.telemetry_loop())
         finally:
-            time.sleep(REFRESH_RATE)
+            if server:
+                server.close()
+            self.telemetry.flush()
+
+
+if __name__ == '__main__':
+    print('Runner Job Start on {0}'.format(
+        time.strftime('%a, %d-%m-%Y %H:%M:%S')))
+    asyncio.run(Controller(CONTROLLER_ID, DB_NAME, API_URL,
+                           push_url=PUSH_URL if PUSH_MODE else None,
+                           pin_factory=make_pin_factory(os.getenv('PIN_FACTORY')),
+                           status_port=STATUS_PORT, status_token=STATUS_TOKEN,
+                           telemetry_url=TELEMETRY_URL if TELEMETRY_MODE else None).run())
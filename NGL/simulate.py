@@ -0,0 +1,189 @@
+""" simulate many NGL controllers in one process against the stand-in slamp API
+
+    python simulate.py --controllers 200 --duration 60 --latency 0.2 --error-rate 0.05
+    python simulate.py --controllers 200 --duration 60 --push --telemetry --json result.json
+
+every controller runs the real runner.Controller with mocked GPIO and its own SQLite file.
+the stand-in server toggles random lamps (config churn) and the report shows how long the
+controllers took to follow (sync lag), CPU time per controller, server requests and SQLite writes.
+CPU time covers the whole process, so it includes the stand-in server.
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import runner
+from standin_server import StandinServer
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class SimController(runner.Controller):
+    """ controller that reports when a churned lamp state reaches its pins """
+
+    def __init__(self, sim, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sim = sim
+        self.write_statements = 0
+        self.commits = 0
+
+    def open(self):
+        super().open()
+        self.conn.set_trace_callback(self.count_statement)
+
+    def count_statement(self, sql):
+        statement = sql.lstrip().upper()
+        if statement.startswith(WRITE_STATEMENTS):
+            self.write_statements += 1
+        elif statement.startswith('COMMIT'):
+            self.commits += 1
+
+    def commit_pins(self, source):
+        transitions = super().commit_pins(source)
+        if source == 'network':
+            for pin, state in transitions:
+                self.sim.applied(self.controller_id, pin, bool(state))
+        return transitions
+
+
+class Simulation:
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.server = StandinServer(args.pins, args.latency, args.jitter, args.error_rate)
+        self.pending = {} # (controller_id, pin) -> (lamp on, time.monotonic() of the change)
+        self.lags = []
+        self.changes = 0
+
+    def applied(self, controller_id, pin, lamp_on):
+        change = self.pending.get((controller_id, pin))
+        if change and change[0] == lamp_on:
+            self.lags.append(time.monotonic() - change[1])
+            del self.pending[(controller_id, pin)]
+
+    async def churn(self, controller_ids):
+        while True:
+            await asyncio.sleep(self.args.churn_interval)
+            count = max(1, int(len(controller_ids) * self.args.churn_fraction))
+            for controller_id in self.rng.sample(controller_ids, count):
+                config = copy.deepcopy(self.server.config_for(controller_id))
+                obj = self.rng.choice(config)
+                obj['isLampOn'] = not obj['isLampOn']
+                self.server.set_config(controller_id, config)
+                self.pending[(controller_id, obj['pin'])] = (obj['isLampOn'], time.monotonic())
+                self.changes += 1
+
+    async def start_controller(self, controller):
+        # real fleets are not synchronised, spread the first fetch over one refresh period
+        await asyncio.sleep(self.rng.uniform(0, self.args.refresh_rate))
+        await controller.run()
+
+    async def run(self):
+        args = self.args
+        workdir = tempfile.mkdtemp(prefix='ngl_sim_')
+        server = await self.server.start('127.0.0.1', args.port)
+        base = 'http://127.0.0.1:{0}/slamp/api/controller'.format(args.port)
+
+        controllers = []
+        for i in range(args.controllers):
+            controller_id = 'SIM{0:04d}'.format(i)
+            controllers.append(SimController(
+                self, controller_id, os.path.join(workdir, 'slamp-{0}.db'.format(controller_id)),
+                '{0}/{1}.do'.format(base, controller_id),
+                refresh_rate=args.refresh_rate,
+                push_url='{0}/{1}/watch.do'.format(base, controller_id) if args.push else None,
+                long_poll_timeout=args.long_poll_timeout,
+                pin_factory=runner.make_pin_factory('mock'),
+                telemetry_url='{0}/{1}/telemetry.do'.format(base, controller_id) if args.telemetry else None,
+                telemetry_interval=args.telemetry_interval,
+            ))
+
+        tasks = [asyncio.ensure_future(self.start_controller(c)) for c in controllers]
+        tasks.append(asyncio.ensure_future(self.churn([c.controller_id for c in controllers])))
+        cpu_start, wall_start = time.process_time(), time.monotonic()
+        try:
+            await asyncio.sleep(args.duration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            server.close()
+
+        cpu = time.process_time() - cpu_start
+        wall = time.monotonic() - wall_start
+        db_bytes = sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+        return self.report(controllers, cpu, wall, db_bytes)
+
+    def report(self, controllers, cpu, wall, db_bytes):
+        lags = sorted(self.lags)
+
+        def percentile(q):
+            return round(lags[min(len(lags) - 1, int(len(lags) * q))] * 1000, 1) if lags else None
+
+        count = len(controllers)
+        return {
+            'controllers': count,
+            'duration_s': round(wall, 1),
+            'push': self.args.push,
+            'latency_s': self.args.latency,
+            'error_rate': self.args.error_rate,
+            'config_changes': self.changes,
+            'changes_applied': len(lags),
+            'sync_lag_p50_ms': percentile(0.5),
+            'sync_lag_p95_ms': percentile(0.95),
+            'sync_lag_max_ms': round(lags[-1] * 1000, 1) if lags else None,
+            'cpu_ms_per_controller_per_s': round(cpu / count / wall * 1000, 3),
+            'server_requests_per_s': round(self.server.requests / wall, 1),
+            'sqlite_write_statements': sum(c.write_statements for c in controllers),
+            'sqlite_commits': sum(c.commits for c in controllers),
+            'sqlite_bytes': db_bytes,
+            'telemetry_events_received': sum(self.server.telemetry.values()),
+            'lamp_switches': sum(c.pins.switch_count for c in controllers),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--controllers', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help='in second')
+    parser.add_argument('--pins', type=lambda v: [int(p) for p in v.split(',') if p], default=[17, 27, 22])
+    parser.add_argument('--refresh-rate', type=float, default=runner.REFRESH_RATE)
+    parser.add_argument('--push', action='store_true', help='use the long-poll push channel')
+    parser.add_argument('--long-poll-timeout', type=float, default=runner.LONG_POLL_TIMEOUT)
+    parser.add_argument('--telemetry', action='store_true', help='upload telemetry to the stand-in server')
+    parser.add_argument('--telemetry-interval', type=float, default=runner.TELEMETRY_INTERVAL)
+    parser.add_argument('--latency', type=float, default=0, help='server delay per request in second')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra server delay in second')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 500')
+    parser.add_argument('--churn-interval', type=float, default=2, help='in second')
+    parser.add_argument('--churn-fraction', type=float, default=0.1, help='controllers changed per churn')
+    parser.add_argument('--port', type=int, default=8801)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help='keep the output of the runners')
+    parser.add_argument('--json', help='save the result to a JSON file')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        result = asyncio.run(Simulation(args).run())
+
+    for key, value in result.items():
+        print('{0:<30}{1}'.format(key, value))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
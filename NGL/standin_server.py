@@ -0,0 +1,129 @@
+""" local stand-in for the slamp controller API, for testing runner.py without the real server
+
+    python standin_server.py --port 8001 --pins 17,27,22
+    SLAMP_URL=http://127.0.0.1:8001/slamp PUSH_MODE=1 python runner.py
+
+endpoints (controller_id is any string, unknown controllers get the default config):
+    GET /slamp/api/controller/<id>.do                 config JSON, ETag + If-None-Match
+    GET /slamp/api/controller/<id>/watch.do?timeout=N long-poll, returns when the config
+                                                      differs from If-None-Match or 304 after N s
+    PUT /slamp/api/controller/<id>.do                 replace the config with the JSON body
+    POST /slamp/api/controller/<id>/telemetry.do      gzip JSON telemetry batch, events are counted
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import random
+import re
+
+import http_server
+
+ROUTE = re.compile(r'^/slamp/api/controller/([^/]+?)(/watch|/telemetry)?\.do$')
+
+
+def default_config(pins):
+    return [{'pin': pin, 'isLampOn': False, 'configTimeStart': '18:00',
+             'configTimeEnd': '06:00', 'configLampStatus': 1} for pin in pins]
+
+
+class StandinServer:
+    """ in-memory controller configs served over a minimal asyncio HTTP/1.1 server """
+
+    def __init__(self, pins, latency=0, jitter=0, error_rate=0):
+        self.pins = pins
+        self.latency = latency # in second, added to every response (plus up to jitter)
+        self.jitter = jitter
+        self.error_rate = error_rate # fraction of requests answered with 500
+        self.configs = {}
+        self.changed = {} # controller_id -> asyncio.Event, set when its config changes
+        self.requests = 0
+        self.telemetry = {} # controller_id -> number of telemetry events received
+
+    def config_for(self, controller_id):
+        if controller_id not in self.configs:
+            self.configs[controller_id] = default_config(self.pins)
+        return self.configs[controller_id]
+
+    def etag_for(self, controller_id):
+        body = json.dumps(self.config_for(controller_id)).encode()
+        return '"{0}"'.format(hashlib.sha1(body).hexdigest()), body
+
+    def set_config(self, controller_id, config):
+        self.configs[controller_id] = config
+        event = self.changed.pop(controller_id, None)
+        if event:
+            event.set()
+
+    async def watch(self, controller_id, etag, timeout):
+        # hold the request until the config differs from the client's copy
+        try:
+            while self.etag_for(controller_id)[0] == etag:
+                event = self.changed.setdefault(controller_id, asyncio.Event())
+                await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def handle_request(self, method, path, query, headers, body):
+        self.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {}, b''
+        match = ROUTE.match(path)
+        if not match:
+            return 404, {}, b''
+        controller_id, action = match.groups()
+
+        if action == '/telemetry':
+            if method != 'POST':
+                return 405, {}, b''
+            try:
+                if headers.get('content-encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                events = json.loads(body.decode())['events']
+            except (OSError, ValueError, KeyError):
+                return 400, {}, b''
+            self.telemetry[controller_id] = self.telemetry.get(controller_id, 0) + len(events)
+            return 204, {}, b''
+
+        watch = action == '/watch'
+        if method == 'PUT' and not watch:
+            try:
+                self.set_config(controller_id, json.loads(body.decode()))
+            except ValueError:
+                return 400, {}, b''
+            return 204, {}, b''
+        if method != 'GET':
+            return 405, {}, b''
+
+        client_etag = headers.get('if-none-match')
+        if watch and client_etag:
+            await self.watch(controller_id, client_etag, float(query.get('timeout', ['30'])[0]))
+
+        etag, config_body = self.etag_for(controller_id)
+        if client_etag == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'ETag': etag, 'Content-Type': 'application/json'}, config_body
+
+    async def start(self, host, port):
+        return await http_server.start_server(self.handle_request, host, port)
+
+
+async def serve(args):
+    server = await StandinServer(args.pins, args.latency, args.jitter, args.error_rate).start(args.host, args.port)
+    print('Stand-in slamp API on http://{0}:{1}/slamp'.format(args.host, args.port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--pins', type=lambda v: [int(p) for p in v.split(',') if p], default=[17, 27, 22])
+    parser.add_argument('--latency', type=float, default=0, help='added delay per request in second')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra delay up to this many second')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 500')
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,99 @@
+import gzip
+import json
+import random
+import time
+
+import http_client
+
+sql_telemetry_table = """CREATE TABLE IF NOT EXISTS telemetry(
+id integer primary key autoincrement,
+ts real not null,
+kind text not null,
+data text not null);"""
+
+
+class TelemetryBuffer:
+    """ state-change and health events in a bounded SQLite ring buffer until they are uploaded """
+
+    def __init__(self, conn, max_events=10000):
+        self.conn = conn
+        self.max_events = max_events
+        self.pending = [] # recorded but not yet written, flushed in one transaction
+        self.conn.execute(sql_telemetry_table)
+
+    def record(self, kind, **data):
+        self.pending.append((time.time(), kind, json.dumps(data)))
+        del self.pending[:-self.max_events]
+
+    def flush(self):
+        if not self.pending:
+            return 0
+        rows, self.pending = self.pending, []
+        with self.conn:
+            self.conn.executemany('INSERT INTO telemetry(ts,kind,data) values(?,?,?)', rows)
+            # ring buffer: the oldest events beyond max_events are dropped
+            self.conn.execute('DELETE FROM telemetry WHERE id <= (SELECT max(id) FROM telemetry) - ?',
+                              (self.max_events,))
+        return len(rows)
+
+    def batch(self, limit):
+        cur = self.conn.execute('SELECT id,ts,kind,data FROM telemetry ORDER BY id LIMIT ?', (limit,))
+        return [{'id': row[0], 'ts': row[1], 'kind': row[2], 'data': json.loads(row[3])}
+                for row in cur.fetchall()]
+
+    def ack(self, last_id):
+        with self.conn:
+            self.conn.execute('DELETE FROM telemetry WHERE id <= ?', (last_id,))
+
+    def count(self):
+        return self.conn.execute('SELECT count(*) FROM telemetry').fetchone()[0] + len(self.pending)
+
+
+class TelemetryUploader:
+    """ uploads the buffer as gzip JSON batches, backing off exponentially while the server fails """
+
+    def __init__(self, buffer, url, controller_id, batch_size=500, base_delay=5, max_delay=3600,
+                 connect_timeout=3, read_timeout=10):
+        self.buffer = buffer
+        self.url = url
+        self.controller_id = controller_id
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.failures = 0
+        self.next_attempt = 0 # time.monotonic()
+        self.uploaded = 0
+
+    async def upload_batch(self):
+        events = self.buffer.batch(self.batch_size)
+        if not events:
+            return 0
+        body = gzip.compress(json.dumps({'controller_id': self.controller_id, 'events': events}).encode())
+        response = await http_client.request(
+            self.url, method='POST', body=body,
+            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+            connect_timeout=self.connect_timeout, read_timeout=self.read_timeout)
+        if not 200 <= response.status < 300:
+            raise http_client.HttpError(response.status, response.body)
+        self.buffer.ack(events[-1]['id'])
+        self.uploaded += len(events)
+        return len(events)
+
+    async def tick(self):
+        """ flush recorded events to SQLite, then upload them unless backing off """
+        self.buffer.flush()
+        if time.monotonic() < self.next_attempt:
+            return
+        try:
+            while await self.upload_batch() == self.batch_size:
+                pass
+        except Exception as e:
+            self.failures += 1
+            delay = min(self.base_delay * 2 ** (self.failures - 1), self.max_delay)
+            # jitter so a fleet that lost the server does not retry in lockstep
+            self.next_attempt = time.monotonic() + delay * random.uniform(0.5, 1.0)
+            print('Failed to upload telemetry, retry in {0:.0f}s: {1!r}'.format(delay, e))
+        else:
+            self.failures = 0
@@ -2,6 +2,7 @@ from flask import render_template, flash, redirect, url_for, request
 from werkzeug.utils import secure_filename
 from app.models.Dataset import *
 from app.models.Detail import *
+from app.config.db import db
 import os
 import pandas as pd
 import numpy as np
@@ -23,11 +24,6 @@ def store(request):
 
     checkNamaData = Dataset.get_by_nama(post['nama_data'])
     if checkNamaData == None:
-        # Menyimpan nama_data kedalam database
-        dataset = Dataset()
-        dataset.nama_data = post['nama_data']
-        dataset.save()
-        
         uploaded_file = request.files['file']
         filename      = secure_filename(uploaded_file.filename)
 
@@ -50,20 +46,25 @@ def store(request):
         # Mengambil hanya bagian tanggal
         df['Date'] = df['Date'].dt.date
 
-        for index, row in df.iterrows():
-            print(row['Date'])
-            print('Execute index ', index, end='... ')
-            tmp_store = {
-                'dataset_id' : dataset.serialize()['id'],
-                'date'       : row['Date'],
-                'open'       : row['Open'],
-                'high'       : row['High'],
-                'low'        : row['Low'],
-                'close'      : row['Close'],
-                'volume'     : row['Volume'],
-            }
-            Detail.insert(tmp_store)
-            print('Done.')
+        # Mapping kolom CSV ke kolom tabel sekaligus untuk semua baris
+        details = df[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']].rename(columns={
+            'Date'   : 'date',
+            'Open'   : 'open',
+            'High'   : 'high',
+            'Low'    : 'low',
+            'Close'  : 'close',
+            'Volume' : 'volume',
+        })
+
+        # Dataset dan semua detailnya disimpan dalam satu transaksi
+        with db.transaction():
+            # Menyimpan nama_data kedalam database
+            dataset = Dataset()
+            dataset.nama_data = post['nama_data']
+            dataset.save()
+
+            details.insert(0, 'dataset_id', dataset.id)
+            Detail.bulk_insert(details.to_dict('records'))
         flash('Data berhasil disimpan.', 'success')
         return redirect(url_for('dataset_index'))
     else:
@@ -11,3 +11,8 @@ class Detail(SoftDeletes,Model):
 
     def fresh_timestamp(self):
         return pendulum.now("Asia/Jakarta")
+
+    def bulk_insert(rows, chunk_size=500):
+        # Satu INSERT multi-row per chunk, panggil di dalam db.transaction()
+        for start in range(0, len(rows), chunk_size):
+            Detail.insert(rows[start:start + chunk_size])
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from inference import InferencePool
+
+
+class EmbeddingBatcher:
+    """ Kumpulkan wajah dari request yang berjalan bersamaan lalu embed dalam satu forward pass """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[np.ndarray], np.ndarray],
+        pool: InferencePool,
+        max_batch_size: int = 16,
+        max_delay: float = 0.005,
+    ):
+        self._embed_batch = embed_batch
+        self._pool = pool
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def embed(self, face: np.ndarray) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((face, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        try:
+            faces = np.stack([face for face, _ in batch])
+            embeddings = await self._pool.run(self._embed_batch, faces)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(np.asarray(embedding).tolist())
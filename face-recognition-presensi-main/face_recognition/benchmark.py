@@ -0,0 +1,279 @@
+""" Benchmark latency dan throughput service face recognition
+
+Contoh:
+    python benchmark.py --corpus ./faces --models Facenet512,ArcFace --detectors opencv,ssd
+
+Setiap kombinasi model/detector diuji di /check-face-presence dan /verify-face dengan
+beberapa level concurrency dan jumlah referensi. Tiap skenario memakai server uvicorn baru
+(port --port) dengan cache embedding dan index kosong, supaya hasil skenario sebelumnya tidak
+terbawa. Request pemanasan (--warmup) tidak ikut diukur, hit ratio cache embedding selama
+pengukuran diambil dari /metrics. Corpus berisi foto wajah (jpg/png); setiap foto dibuat
+variasi ukuran (--sizes) dan rotasi (--rotations) secara deterministik.
+"""
+import argparse
+import glob
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import cv2
+import numpy as np
+
+CACHE_LOOKUP = re.compile(r'^face_embedding_cache_lookups_total\{result="(hit|miss)"\} (\S+)$', re.MULTILINE)
+
+ROTATE_CODES = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+
+def build_corpus(corpus_dir: str, sizes: List[int], rotations: List[int]) -> List[Tuple[str, bytes]]:
+    paths = sorted(
+        path for ext in ("jpg", "jpeg", "png")
+        for path in glob.glob(os.path.join(corpus_dir, f"*.{ext}"))
+    )
+    if not paths:
+        raise SystemExit(f"Tidak ada gambar di {corpus_dir}")
+
+    variants = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        for size in sizes:
+            scale = size / max(image.shape[:2])
+            resized = cv2.resize(
+                image, (round(image.shape[1] * scale), round(image.shape[0] * scale)),
+                interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC,
+            )
+            for angle in rotations:
+                rotated = cv2.rotate(resized, ROTATE_CODES[angle]) if angle in ROTATE_CODES else resized
+                ok, buf = cv2.imencode(".jpg", rotated, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                if ok:
+                    variants.append((f"{name}_{size}_{angle}.jpg", buf.tobytes()))
+    return variants
+
+
+def encode_multipart(fields: List[Tuple[str, str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid4().hex
+    parts = []
+    for name, filename, content in fields:
+        parts.append(
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n".encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def post(host: str, port: int, path: str, body: bytes, content_type: str) -> Tuple[int, float]:
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(host, port, timeout=300)
+    try:
+        conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def run_scenario(host, port, path, requests: List[Tuple[bytes, str]], concurrency: int) -> Dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda req: post(host, port, path, *req), requests))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for status, latency in results if status == 200]
+    statuses: Dict[str, int] = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        "requests": len(results),
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": len(latencies) / elapsed,
+    }
+
+
+def presence_requests(corpus, count, rng) -> List[Tuple[bytes, str]]:
+    return [
+        encode_multipart([("image", *rng.choice(corpus))])
+        for _ in range(count)
+    ]
+
+
+def verify_requests(corpus, count, ref_count, rng) -> List[Tuple[bytes, str]]:
+    requests = []
+    for _ in range(count):
+        photo, *references = rng.sample(corpus, ref_count + 1)
+        fields = [("photo", *photo)] + [("references", *ref) for ref in references]
+        requests.append(encode_multipart(fields))
+    return requests
+
+
+def cache_lookups(host, port) -> Dict[str, float]:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        conn.request("GET", "/metrics")
+        text = conn.getresponse().read().decode()
+    finally:
+        conn.close()
+    return {result: float(value) for result, value in CACHE_LOOKUP.findall(text)}
+
+
+def hit_ratio(before: Dict[str, float], after: Dict[str, float]) -> Optional[float]:
+    hits = after.get("hit", 0) - before.get("hit", 0)
+    misses = after.get("miss", 0) - before.get("miss", 0)
+    return hits / (hits + misses) if hits + misses else None
+
+
+def wait_until_ready(host, port, process, timeout) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server berhenti sebelum siap")
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(1)
+    raise RuntimeError("Server tidak siap dalam batas waktu")
+
+
+@contextmanager
+def fresh_server(args, model, detector):
+    # Server baru dengan cache embedding dan index kosong di folder sementara
+    workdir = tempfile.mkdtemp(prefix="face_bench_")
+    env = dict(
+        os.environ,
+        MODEL_NAME=model,
+        DETECTOR_BACKEND=detector,
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.db"),
+        FACE_INDEX_PATH=os.path.join(workdir, "face_index.db"),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", args.host, "--port", str(args.port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    try:
+        wait_until_ready(args.host, args.port, process, args.startup_timeout)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def measure(args, model, detector, path, requests, concurrency) -> Dict:
+    # requests[:warmup] hanya pemanasan, yang diukur request sesudahnya
+    with fresh_server(args, model, detector):
+        run_scenario(args.host, args.port, path, requests[:args.warmup], concurrency)
+        before = cache_lookups(args.host, args.port)
+        result = run_scenario(args.host, args.port, path, requests[args.warmup:], concurrency)
+        result["cache_hit_ratio"] = hit_ratio(before, cache_lookups(args.host, args.port))
+    return result
+
+
+def benchmark_combination(args, model, detector, corpus) -> List[Dict]:
+    rng = random.Random(args.seed)
+    count = args.warmup + args.requests
+    rows = []
+    for concurrency in args.concurrency:
+        requests = presence_requests(corpus, count, rng)
+        result = measure(args, model, detector, "/check-face-presence", requests, concurrency)
+        rows.append(dict(model=model, detector=detector, endpoint="/check-face-presence",
+                         concurrency=concurrency, references=0, **result))
+
+        for ref_count in args.references:
+            requests = verify_requests(corpus, count, ref_count, rng)
+            result = measure(args, model, detector, "/verify-face", requests, concurrency)
+            rows.append(dict(model=model, detector=detector, endpoint="/verify-face",
+                             concurrency=concurrency, references=ref_count, **result))
+    return rows
+
+
+def print_rows(rows: List[Dict]) -> None:
+    header = f"{'model':<12}{'detector':<10}{'endpoint':<22}{'conc':>5}{'refs':>5}" \
+             f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>8}{'hit %':>7}  statuses"
+    print(header)
+    for row in rows:
+        hits = "-" if row["cache_hit_ratio"] is None else f"{row['cache_hit_ratio'] * 100:.0f}"
+        print(
+            f"{row['model']:<12}{row['detector']:<10}{row['endpoint']:<22}"
+            f"{row['concurrency']:>5}{row['references']:>5}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+            f"{row['throughput_rps']:>8.2f}{hits:>7}  {row['statuses']}"
+        )
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def str_list(value: str) -> List[str]:
+    return [v for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="folder berisi foto wajah")
+    parser.add_argument("--models", type=str_list, default=["Facenet512"])
+    parser.add_argument("--detectors", type=str_list, default=["opencv"])
+    parser.add_argument("--sizes", type=int_list, default=[480, 1280, 4032], help="sisi terpanjang variasi gambar")
+    parser.add_argument("--rotations", type=int_list, default=[0, 90, 180, 270])
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 8])
+    parser.add_argument("--references", type=int_list, default=[1, 3, 5])
+    parser.add_argument("--requests", type=int, default=50, help="jumlah request yang diukur per skenario")
+    parser.add_argument("--warmup", type=int, default=3, help="request pemanasan per skenario, di luar --requests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="simpan hasil ke file JSON")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus, args.sizes, args.rotations)
+    if len(corpus) < max(args.references) + 1:
+        raise SystemExit("Corpus terlalu kecil untuk jumlah referensi yang diminta")
+    print(f"Corpus: {len(corpus)} variasi gambar")
+
+    rows = []
+    for model in args.models:
+        for detector in args.detectors:
+            print(f"== {model} / {detector}")
+            rows.extend(benchmark_combination(args, model, detector, corpus))
+
+    print_rows(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
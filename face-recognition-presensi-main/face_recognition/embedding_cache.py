@@ -0,0 +1,109 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """ Simpan embedding di SQLite dengan key hash isi file + nama model, eviction LRU """
+
+    def __init__(self, path: str, max_entries: int = 10000, touch_batch: int = 100, touch_interval: float = 60):
+        self.max_entries = max_entries
+        # last_used hanya dipakai untuk urutan eviction, jadi cukup ditulis per batch
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # Koneksi dibuka saat pertama dipakai di tiap proses. Koneksi SQLite tidak boleh
+        # dipakai lintas fork(), misalnya objek ini dibuat di master gunicorn --preload
+        if self._conn is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commit tidak fsync, cukup saat checkpoint. Yang bisa hilang saat
+        # listrik mati hanya embedding cache yang bisa dihitung ulang
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings(
+            key text primary key,
+            embedding blob not null,
+            last_used real not null)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._touched: Dict[str, float] = {}
+        self._touched_at = time.monotonic()
+        # Jumlah baris dihitung sekali lalu dijaga sendiri. Worker lain yang memakai file yang
+        # sama tidak terlihat di sini, jadi dihitung ulang setiap kali batasnya terlewati
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(content: bytes, model_name: str) -> str:
+        return hashlib.sha256(model_name.encode() + b"\0" + content).hexdigest()
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used=? WHERE key=?",
+                [(last_used, key) for key, last_used in self._touched.items()],
+            )
+            self._touched = {}
+        self._touched_at = time.monotonic()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            self._connect()
+            row = self._conn.execute(
+                "SELECT embedding FROM embeddings WHERE key=?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch or time.monotonic() - self._touched_at >= self.touch_interval:
+                self._write_touched()
+                self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, key: str, embedding: List[float]):
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            self._connect()
+            # last_used yang tertunda ikut ditulis sebelum eviction memilih baris terlama
+            self._write_touched()
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO embeddings(key, embedding, last_used) VALUES(?,?,?)",
+                (key, blob, time.time()),
+            )
+            if cur.rowcount:
+                self._count += 1
+            else:
+                self._conn.execute(
+                    "UPDATE embeddings SET embedding=?, last_used=? WHERE key=?", (blob, time.time(), key)
+                )
+            if self._count > self.max_entries:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.max_entries:
+                # Buang entry yang paling lama tidak dipakai, sisakan ruang 1% supaya COUNT
+                # tidak dijalankan lagi di setiap insert berikutnya
+                slack = max(1, self.max_entries // 100)
+                cur = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (self._count - self.max_entries + slack,),
+                )
+                self._count -= cur.rowcount
+            self._conn.commit()
+
+    def flush(self):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                return
+            self._write_touched()
+            self._conn.commit()
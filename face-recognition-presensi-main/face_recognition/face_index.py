@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_distances(query: List[float], matrix: np.ndarray) -> np.ndarray:
+    """ Jarak cosine satu embedding terhadap semua baris matrix sekaligus """
+    query = normalize_rows(np.asarray(query, dtype=np.float64))
+    return 1.0 - normalize_rows(np.asarray(matrix, dtype=np.float64)) @ query
+
+
+class FaceIndex:
+    """ Embedding user yang sudah enroll, disimpan di SQLite dan dicari lewat matrix NumPy """
+
+    def __init__(self, path: str, model_name: str):
+        self.model_name = model_name
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._user_ids: List[str] = []
+        self._user_rows: Dict[str, List[int]] = {}
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def _connect(self):
+        # Dibuka saat pertama dipakai (di thread, bukan di event loop)
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS enrolled_faces(
+            id integer primary key,
+            user_id text not null,
+            model_name text not null,
+            embedding blob not null)""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_enrolled_faces_user ON enrolled_faces(model_name, user_id)"
+        )
+        self._conn.commit()
+
+    def _reload_if_changed(self):
+        self._connect()
+        # data_version berubah kalau worker lain commit ke database yang sama
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        rows = self._conn.execute(
+            "SELECT user_id, embedding FROM enrolled_faces WHERE model_name=? ORDER BY id",
+            (self.model_name,),
+        ).fetchall()
+        self._user_ids = [row[0] for row in rows]
+        self._user_rows = {}
+        for i, user_id in enumerate(self._user_ids):
+            self._user_rows.setdefault(user_id, []).append(i)
+        if rows:
+            self._matrix = normalize_rows(
+                np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            )
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._data_version = version
+
+    def enroll(self, user_id: str, embeddings: List[List[float]]) -> int:
+        with self._lock:
+            self._connect()
+            # Enroll ulang menggantikan embedding lama milik user
+            self._conn.execute(
+                "DELETE FROM enrolled_faces WHERE user_id=? AND model_name=?",
+                (user_id, self.model_name),
+            )
+            self._conn.executemany(
+                "INSERT INTO enrolled_faces(user_id, model_name, embedding) VALUES(?,?,?)",
+                [
+                    (user_id, self.model_name, np.asarray(e, dtype=np.float32).tobytes())
+                    for e in embeddings
+                ],
+            )
+            self._conn.commit()
+            self._data_version = None
+        return len(embeddings)
+
+    def remove(self, user_id: str) -> int:
+        with self._lock:
+            self._connect()
+            cur = self._conn.execute(
+                "DELETE FROM enrolled_faces WHERE user_id=? AND model_name=?",
+                (user_id, self.model_name),
+            )
+            self._conn.commit()
+            self._data_version = None
+        return cur.rowcount
+
+    def embeddings_for(self, user_id: str) -> np.ndarray:
+        with self._lock:
+            self._reload_if_changed()
+            return self._matrix[self._user_rows.get(user_id, [])]
+
+    def search(self, embedding: List[float], top_k: int = 5) -> List[Dict]:
+        if top_k < 1:
+            raise ValueError("top_k minimal 1")
+        with self._lock:
+            self._reload_if_changed()
+            user_ids, matrix = self._user_ids, self._matrix
+        if not user_ids:
+            return []
+
+        distances = 1.0 - matrix @ normalize_rows(np.asarray(embedding, dtype=np.float32))
+
+        # Ambil jarak terkecil per user, lalu urutkan
+        best: Dict[str, float] = {}
+        for idx in np.argsort(distances):
+            user_id = user_ids[idx]
+            if user_id not in best:
+                best[user_id] = float(distances[idx])
+                if len(best) >= top_k:
+                    break
+        return [{"user_id": uid, "distance": dist} for uid, dist in best.items()]
@@ -0,0 +1,39 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+
+class InferenceQueueFull(Exception):
+    pass
+
+
+class InferencePool:
+    """ Jalankan inference model di luar event loop dengan antrian yang dibatasi """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._admitted = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    @contextmanager
+    def admit(self):
+        # Admission sekali di awal request. Pekerjaan request yang sudah diterima (deteksi,
+        # batch embedding) tidak ditolak lagi di tengah jalan. Hanya diakses dari event loop,
+        # jadi counter tidak perlu lock
+        if self._admitted >= self.workers + self.queue_size:
+            raise InferenceQueueFull()
+
+        self._admitted += 1
+        try:
+            yield
+        finally:
+            self._admitted -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,37 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+class BodySizeLimit:
+    """ Middleware ASGI yang menghentikan body request begitu melewati batas ukuran """
+
+    def __init__(self, app, max_body_size: int, detail: str):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Content-Length yang sudah kelebihan langsung ditolak tanpa membaca body
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse(status_code=413, content={"detail": self.detail})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Dilempar di tengah parsing multipart, FastAPI meneruskannya jadi response 413
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
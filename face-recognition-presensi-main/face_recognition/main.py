@@ -1,35 +1,321 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import Depends, FastAPI, File, Form, Request, Response, UploadFile, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from deepface import DeepFace
-import shutil
+from deepface.models.FacialRecognition import FacialRecognition
+from deepface.modules import preprocessing
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import io
+import json
+import logging
 import os
-from uuid import uuid4
-from typing import List
+from typing import Dict, List, Optional, Tuple, Union
 from scipy.spatial.distance import cosine
 import cv2
 import numpy as np
+from PIL import Image
+from embedding_cache import EmbeddingCache
+from face_index import cosine_distances
+from inference import InferencePool, InferenceQueueFull
+from limits import BodySizeLimit
+from registry import FaceProfile, ModelRegistry, preload_weights
+from quality import QualityGate
+from metrics import Counter, Histogram, RequestDuration, render as render_metrics
 
-app = FastAPI()
-
-MODEL_NAME = "Facenet512"
+MODEL_NAME = os.getenv("MODEL_NAME", "Facenet512")
 # MODEL_NAME = "ArcFace"
-DETECTOR_BACKEND = "opencv"
-THRESHOLD = 0.5
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "opencv")
+THRESHOLD = float(os.getenv("THRESHOLD", "0.5"))
+
+# Profil "default" memakai MODEL_NAME/DETECTOR_BACKEND/THRESHOLD. Profil lain dalam JSON, contoh:
+# FACE_PROFILES='{"kiosk": {"detector_backend": "opencv"},
+#                 "admin": {"model_name": "ArcFace", "detector_backend": "retinaface", "threshold": 0.68}}'
+FACE_PROFILES = json.loads(os.getenv("FACE_PROFILES", "{}"))
+# Profil bawaan per endpoint (bisa ditimpa field "profile" di request), contoh:
+# ENDPOINT_PROFILES='{"/verify-face": "kiosk", "/verify-batch": "admin"}'
+ENDPOINT_PROFILES = json.loads(os.getenv("ENDPOINT_PROFILES", "{}"))
+
+# VERIFY_MODE: "early_exit" berhenti di referensi pertama yang cocok,
+# "all" meng-embed semua referensi bersamaan lalu digabung dengan VERIFY_AGGREGATION
+# ("min", "mean" atau "k_of_n" dengan minimal VERIFY_K referensi cocok)
+VERIFY_MODE = os.getenv("VERIFY_MODE", "early_exit")
+VERIFY_AGGREGATION = os.getenv("VERIFY_AGGREGATION", "min")
+VERIFY_K = int(os.getenv("VERIFY_K", "1"))
+
+if VERIFY_MODE not in ("early_exit", "all"):
+    raise ValueError(f"VERIFY_MODE tidak dikenal: {VERIFY_MODE}")
+if VERIFY_AGGREGATION not in ("min", "mean", "k_of_n"):
+    raise ValueError(f"VERIFY_AGGREGATION tidak dikenal: {VERIFY_AGGREGATION}")
+if VERIFY_K < 1:
+    raise ValueError(f"VERIFY_K minimal 1: {VERIFY_K}")
+
+# Urutan rotasi yang dicoba, foto selfie biasanya sudah tegak
+ROTATION_ORDER = [0, 90, 270, 180]
+
+# Sisi terpanjang gambar sebelum deteksi, foto HP 12MP cukup dideteksi di resolusi ini
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "640"))
+
+# Batas upload: per file, per request (seluruh body multipart) dan jumlah foto referensi.
+# Resolusi dicek dari header gambar sebelum di-decode
+MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB", "10"))
+MAX_REQUEST_SIZE_MB = int(os.getenv("MAX_REQUEST_SIZE_MB", "50"))
+MAX_REFERENCES = int(os.getenv("MAX_REFERENCES", "10"))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+FACE_INDEX_PATH = os.getenv("FACE_INDEX_PATH", "face_index.db")
+# top_k /identify lebih dari ini dipotong ke MAX_TOP_K
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "50"))
+
+# Foto yang terlalu gelap/terang/buram atau wajahnya terlalu kecil ditolak (422) sebelum
+# deteksi dan embedding. Blur = variansi Laplacian, kecerahan = rata-rata grayscale 0-255,
+# ukuran wajah = sisi terpendek kotak wajah dalam piksel gambar yang sudah diperkecil
+QUALITY_GATE = os.getenv("QUALITY_GATE", "1") == "1"
+QUALITY_MIN_BLUR = float(os.getenv("QUALITY_MIN_BLUR", "15"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "30"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "230"))
+QUALITY_MIN_FACE_SIZE = int(os.getenv("QUALITY_MIN_FACE_SIZE", "40"))
+
+QUALITY_MESSAGES = {
+    "dark": "Foto terlalu gelap.",
+    "bright": "Foto terlalu terang.",
+    "blur": "Foto terlalu buram.",
+    "small_face": "Wajah terlalu kecil, dekatkan kamera.",
+    "no_face": "Wajah tidak terdeteksi, pastikan wajah terlihat jelas.",
+}
+
+# Jumlah thread inference per worker uvicorn dan panjang antrian sebelum ditolak 503
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+
+# Wajah dari request yang bersamaan digabung jadi satu batch selama beberapa milidetik
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+EMBEDDING_BATCH_DELAY_MS = float(os.getenv("EMBEDDING_BATCH_DELAY_MS", "5"))
+
+# Jumlah foto /verify-batch yang diproses bersamaan, sisanya menunggu giliran
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(INFERENCE_WORKERS * 2)))
+BATCH_MAX_ATTEMPTS = 3
+
+# PRELOAD_MODEL=1 (untuk gunicorn --preload) mengunduh bobot model sekali di master lewat
+# proses "spawn" terpisah. Model TensorFlow sengaja tidak dibangun sebelum fork: runtime TF
+# (thread pool, state GPU) tidak aman diwariskan lewat fork() dan worker bisa hang. Tiap
+# worker membangun modelnya sendiri saat warm-up dari file bobot yang sudah ada di disk
+# (dan page cache yang memang dibagi antar proses)
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "0") == "1"
+
+# Warm-up yang gagal dicoba lagi dengan jeda yang berlipat, /health tetap 503 selama itu
+WARM_UP_RETRY_DELAY = float(os.getenv("WARM_UP_RETRY_DELAY", "5"))
+WARM_UP_MAX_RETRY_DELAY = float(os.getenv("WARM_UP_MAX_RETRY_DELAY", "300"))
+
+logger = logging.getLogger("uvicorn.error")
+model_ready = False
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_SIZE)
+inference_pool = InferencePool(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE)
+quality_gate = QualityGate(QUALITY_MIN_BLUR, QUALITY_MIN_BRIGHTNESS, QUALITY_MAX_BRIGHTNESS, QUALITY_MIN_FACE_SIZE)
+
+rotation_selected = Counter(
+    "face_rotation_selected_total",
+    "Rotasi gambar yang dipakai untuk embedding (fallback = tanpa deteksi wajah)",
+    ["rotation"],
+)
+detection_failures = Counter(
+    "face_detection_failures_total",
+    "Deteksi wajah dengan enforce_detection=True yang gagal",
+    ["stage"],
+)
+quality_rejections = Counter(
+    "face_quality_rejections_total",
+    "Foto yang ditolak quality gate sebelum embedding",
+    ["reason"],
+)
+embedding_cache_lookups = Counter(
+    "face_embedding_cache_lookups_total",
+    "Lookup embedding referensi ke cache",
+    ["result"],
+)
+stage_duration = Histogram(
+    "face_stage_duration_seconds",
+    "Durasi tiap tahap pipeline (upload, decode, resize, quality, detection, embedding, distance)",
+    ["stage"],
+)
+embedding_batch_size = Histogram(
+    "face_embedding_batch_size",
+    "Jumlah wajah per forward pass model",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+request_duration = Histogram(
+    "face_request_duration_seconds",
+    "Durasi request HTTP per endpoint",
+    ["method", "endpoint", "status"],
+)
+
+
+def embed_batch(model_name: str, faces: np.ndarray) -> np.ndarray:
+    client = model_registry.get_model(model_name)
+    embedding_batch_size.observe(len(faces))
+    with stage_duration.time(stage="embedding"):
+        if type(client).forward is FacialRecognition.forward:
+            # Model Keras biasa: satu forward pass untuk seluruh batch
+            return client.model(faces, training=False).numpy()
+        # SFace, Dlib dan VGG-Face punya forward sendiri (bukan Keras / ada normalisasi
+        # tambahan), jadi di-embed satu per satu
+        return np.asarray([client.forward(face[np.newaxis]) for face in faces])
+
+model_registry = ModelRegistry(
+    embed_batch,
+    inference_pool,
+    FACE_INDEX_PATH,
+    max_batch_size=EMBEDDING_BATCH_SIZE,
+    max_delay=EMBEDDING_BATCH_DELAY_MS / 1000,
+)
+model_registry.add_profile("default", MODEL_NAME, DETECTOR_BACKEND, THRESHOLD)
+for profile_name, profile_config in FACE_PROFILES.items():
+    model_registry.add_profile(
+        profile_name,
+        profile_config.get("model_name", MODEL_NAME),
+        profile_config.get("detector_backend", DETECTOR_BACKEND),
+        float(profile_config.get("threshold", THRESHOLD)),
+    )
+
+# Profil yang dipakai endpoint dipanaskan saat startup, profil lain dibangun saat pertama dipakai
+startup_profiles = [model_registry.profile("default")]
+for endpoint, profile_name in ENDPOINT_PROFILES.items():
+    try:
+        endpoint_profile = model_registry.profile(profile_name)
+    except KeyError:
+        raise ValueError(f"Profil {profile_name} untuk {endpoint} tidak ada di FACE_PROFILES")
+    if endpoint_profile not in startup_profiles:
+        startup_profiles.append(endpoint_profile)
+
+if PRELOAD_MODEL:
+    preload_weights({profile.model_name for profile in startup_profiles})
+
+
+async def warm_up_model():
+    global model_ready
+    for profile in startup_profiles:
+        delay = WARM_UP_RETRY_DELAY
+        while True:
+            try:
+                await inference_pool.run(warm_up, profile)
+                break
+            except Exception:
+                logger.exception("Warm-up profil %s gagal, dicoba lagi dalam %.0f detik", profile.name, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WARM_UP_MAX_RETRY_DELAY)
+        logger.info("Profil %s (%s/%s) siap dipakai", profile.name, profile.model_name, profile.detector_backend)
+    model_ready = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up berjalan di background, /health baru 200 setelah selesai
+    warm_up_task = asyncio.create_task(warm_up_model())
+    yield
+    warm_up_task.cancel()
+    inference_pool.shutdown()
+    embedding_cache.flush()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    BodySizeLimit,
+    max_body_size=MAX_REQUEST_SIZE_MB * 1024 * 1024,
+    detail=f"Ukuran request melebihi batas {MAX_REQUEST_SIZE_MB} MB.",
+)
+app.add_middleware(RequestDuration, histogram=request_duration, stage_histogram=stage_duration)
+
+
+class QualityRejected(HTTPException):
+    def __init__(self, reason: str, quality: Dict):
+        super().__init__(status_code=422, detail=QUALITY_MESSAGES[reason])
+        self.reason = reason
+        self.quality = quality
+
+
+@app.exception_handler(QualityRejected)
+async def quality_rejected_handler(request: Request, exc: QualityRejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail, "quality": exc.quality})
 
-def is_face_present(image_path: str) -> bool:
+
+def find_face_area(image: np.ndarray, detector_backend: str) -> Optional[Dict]:
     try:
-        _ = DeepFace.extract_faces(
-            img_path=image_path,
+        face_objs = DeepFace.extract_faces(
+            img_path=image,
+            detector_backend=detector_backend,
             enforce_detection=True
         )
-        return True
+        return face_objs[0]["facial_area"]
     except Exception:
-        return False
+        return None
+
+def is_face_present(image: np.ndarray, detector_backend: str) -> bool:
+    return find_face_area(image, detector_backend) is not None
+
+def upload_too_large(filename: str) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Ukuran file {filename} melebihi batas {MAX_UPLOAD_SIZE_MB} MB.",
+    )
+
+async def read_upload(file: UploadFile) -> bytes:
+    limit = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    if file.size is not None and file.size > limit:
+        raise upload_too_large(file.filename)
+
+    # Stage "upload" diukur di RequestDuration saat body diterima, di sini file sudah di-spool
+    chunks, total = [], 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > limit:
+            raise upload_too_large(file.filename)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def check_references(files: List[UploadFile]):
+    if len(files) > MAX_REFERENCES:
+        raise HTTPException(status_code=400, detail=f"Jumlah foto maksimal {MAX_REFERENCES}.")
+
+def min_references() -> int:
+    # k_of_n butuh minimal VERIFY_K referensi untuk bisa cocok
+    return VERIFY_K if VERIFY_MODE == "all" and VERIFY_AGGREGATION == "k_of_n" else 1
+
+def decode_flags(content: bytes) -> Tuple[int, Optional[int]]:
+    # Baca ukuran dari header saja. JPEG besar langsung di-decode di 1/2, 1/4 atau 1/8
+    # resolusi (DCT scaling) selama sisi terpanjangnya masih >= MAX_IMAGE_SIDE
+    try:
+        with Image.open(io.BytesIO(content)) as header:
+            width, height = header.size
+            image_format = header.format
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Resolusi gambar terlalu besar.")
+    except Exception:
+        # Format yang tidak dikenali Pillow tetap dicoba oleh OpenCV
+        return cv2.IMREAD_COLOR, None
+
+    if width * height > MAX_IMAGE_PIXELS:
+        raise HTTPException(status_code=413, detail="Resolusi gambar terlalu besar.")
 
-def save_upload(file: UploadFile) -> str:
-    path = f"temp_{uuid4().hex}_{file.filename}"
-    with open(path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    return path
+    longest = max(width, height)
+    if image_format == "JPEG":
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if longest / factor >= MAX_IMAGE_SIDE:
+                return flag, longest
+    return cv2.IMREAD_COLOR, longest
+
+def decode_image(content: bytes) -> Tuple[np.ndarray, float]:
+    # Skala kedua = ukuran hasil decode / ukuran asli, untuk memetakan kotak wajah ke foto asli
+    flags, longest = decode_flags(content)
+    with stage_duration.time(stage="decode"):
+        image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), flags)
+    if image is None:
+        raise HTTPException(status_code=400, detail="File bukan gambar yang valid.")
+    return image, max(image.shape[:2]) / longest if longest else 1.0
 
 def rotate_image(image: np.ndarray, angle: int) -> np.ndarray:
     if angle == 90:
@@ -41,57 +327,256 @@ def rotate_image(image: np.ndarray, angle: int) -> np.ndarray:
     else:
         return image
 
-def try_rotations_for_embedding(image_path: str) -> List[float]:
-    original = cv2.imread(image_path)
-    rotations = [90, 180, 270]
-    last_exception = None
+def downscale_image(image: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(
+        image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA
+    )
 
-    # Coba rotasi 90, 180, 270
-    for angle in rotations:
-        rotated = rotate_image(original, angle)
-        temp_rotated_path = f"{image_path}_rotated_{angle}.jpg"
-        cv2.imwrite(temp_rotated_path, rotated)
+def prepare_image(image: np.ndarray, decode_scale: float = 1.0) -> Tuple[np.ndarray, float]:
+    with stage_duration.time(stage="resize"):
+        working = downscale_image(image, MAX_IMAGE_SIDE)
+    return working, decode_scale * working.shape[1] / image.shape[1]
 
-        try:
-            embedding = DeepFace.represent(
-                img_path=temp_rotated_path,
-                model_name=MODEL_NAME,
-                detector_backend=DETECTOR_BACKEND,
-                enforce_detection=True
-            )[0]["embedding"]
+def map_box_to_original(area: Dict, angle: int, working_shape: Tuple, scale: float) -> Dict:
+    # Koordinat dari gambar kecil yang dirotasi dikembalikan ke gambar asli
+    height, width = working_shape[:2]
+    x, y, w, h = area["x"], area["y"], area["w"], area["h"]
+    if angle == 90:
+        x, y, w, h = y, height - x - w, h, w
+    elif angle == 180:
+        x, y = width - x - w, height - y - h
+    elif angle == 270:
+        x, y, w, h = width - y - h, x, h, w
+    return {key: int(round(value / scale)) for key, value in (("x", x), ("y", y), ("w", w), ("h", h))}
+
+def check_image_quality(image: np.ndarray) -> Dict:
+    # Dihitung di gambar yang sudah diperkecil, jauh lebih murah dari satu kali deteksi
+    with stage_duration.time(stage="quality"):
+        scores = quality_gate.image_scores(image)
+    reason = quality_gate.image_problem(scores)
+    if QUALITY_GATE and reason:
+        quality_rejections.inc(reason=reason)
+        raise QualityRejected(reason, scores)
+    return scores
+
+def check_face_size(area: Dict, scores: Dict) -> Dict:
+    scores = dict(scores, face_size=int(min(area["w"], area["h"])))
+    reason = quality_gate.face_problem(scores["face_size"])
+    if QUALITY_GATE and reason:
+        quality_rejections.inc(reason=reason)
+        raise QualityRejected(reason, scores)
+    return scores
 
-            os.remove(temp_rotated_path)
-            return embedding
+def detect_face(image: np.ndarray, enforce_detection: bool, profile: FaceProfile) -> Tuple[np.ndarray, Dict]:
+    with stage_duration.time(stage="detection"):
+        face_obj = DeepFace.extract_faces(
+            img_path=image,
+            detector_backend=profile.detector_backend,
+            enforce_detection=enforce_detection,
+            align=True
+        )[0]
 
+    # Samakan dengan preprocessing DeepFace.represent: RGB -> BGR, resize, normalisasi
+    target_size = profile.get_model().input_shape
+    face = preprocessing.resize_image(img=face_obj["face"][:, :, ::-1], target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=face, normalization="base")[0], face_obj["facial_area"]
+
+def try_rotations_for_face(original: np.ndarray, profile: FaceProfile, decode_scale: float = 1.0) -> Tuple[np.ndarray, Dict]:
+    # Orientasi EXIF sudah diterapkan oleh cv2.imdecode. Deteksi dilakukan sekali per
+    # rotasi di gambar yang diperkecil, crop wajahnya langsung dipakai untuk embedding
+    working, scale = prepare_image(original, decode_scale)
+    scores = check_image_quality(working)
+    last_exception = None
+
+    for angle in ROTATION_ORDER:
+        try:
+            face, area = detect_face(rotate_image(working, angle), True, profile)
         except Exception as e:
+            detection_failures.inc(stage="detect")
             last_exception = e
-            os.remove(temp_rotated_path)
             continue
 
+        info = {"facial_area": map_box_to_original(area, angle, working.shape, scale),
+                "quality": check_face_size(area, scores)}
+        rotation_selected.inc(rotation=angle)
+        return face, info
+
+    # Dengan quality gate, foto tanpa wajah terdeteksi ditolak alih-alih di-embed utuh
+    if QUALITY_GATE:
+        quality_rejections.inc(reason="no_face")
+        raise QualityRejected("no_face", scores)
+
     # Fallback: coba gambar original meskipun enforce_detection=False
     try:
-        embedding = DeepFace.represent(
-            img_path=image_path,
-            model_name=MODEL_NAME,
-            detector_backend=DETECTOR_BACKEND,
-            enforce_detection=False
-        )[0]["embedding"]
-        return embedding
+        face, area = detect_face(working, False, profile)
+        rotation_selected.inc(rotation="fallback")
+        return face, {"facial_area": map_box_to_original(area, 0, working.shape, scale), "quality": scores}
 
     except Exception as e:
         raise Exception(f"Gagal mendeteksi wajah dari semua rotasi dan gambar asli: {str(last_exception or e)}")
 
+def warm_up(profile: FaceProfile):
+    # Bangun model dan detector lalu jalankan sekali dengan gambar kosong
+    target_size = profile.get_model().input_shape
+    blank = np.zeros((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE, 3), dtype=np.uint8)
+    is_face_present(blank, profile.detector_backend)
+    embed_batch(profile.model_name, np.zeros((1, target_size[1], target_size[0], 3), dtype=np.float32))
+
+def upload_face(content: bytes, profile: FaceProfile) -> Tuple[np.ndarray, Dict]:
+    image, decode_scale = decode_image(content)
+    return try_rotations_for_face(image, profile, decode_scale)
+
+def upload_has_face(content: bytes, profile: FaceProfile) -> bool:
+    image, _ = prepare_image(*decode_image(content))
+    scores = check_image_quality(image)
+    with stage_duration.time(stage="detection"):
+        area = find_face_area(image, profile.detector_backend)
+    if area is None:
+        detection_failures.inc(stage="presence")
+        return False
+    check_face_size(area, scores)
+    return True
+
+def resolve_profile(endpoint: str, name: Optional[str]) -> FaceProfile:
+    name = name or ENDPOINT_PROFILES.get(endpoint, "default")
+    try:
+        return model_registry.profile(name)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Profil model tidak dikenal: {name}")
+
+def server_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server sedang sibuk, coba lagi nanti.",
+        headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+    )
+
+@contextmanager
+def admit_request():
+    # Antrian penuh ditolak 503 sebelum pekerjaan apa pun dimulai
+    try:
+        with inference_pool.admit():
+            yield
+    except InferenceQueueFull:
+        raise server_busy()
+
+async def request_admission():
+    # Dependency endpoint: slot dipegang sampai endpoint selesai, deteksi dan batch
+    # embedding request ini tidak bisa ditolak lagi di tengah jalan
+    with admit_request():
+        yield
+
+async def upload_embedding(content: bytes, profile: FaceProfile) -> Tuple[List[float], Dict]:
+    # Dict kedua berisi facial_area dan skor quality untuk dimasukkan ke response
+    face, info = await inference_pool.run(upload_face, content, profile)
+    return await profile.batcher.embed(face), info
+
+def aggregate_distances(distances: np.ndarray, threshold: float) -> Tuple[bool, float]:
+    if VERIFY_AGGREGATION == "mean":
+        score = float(np.mean(distances))
+    elif VERIFY_AGGREGATION == "k_of_n":
+        # Cocok kalau minimal k referensi di bawah threshold, yaitu jarak terkecil ke-k.
+        # Referensi yang kurang dari k tidak pernah cocok, kebijakannya tidak dilonggarkan
+        if len(distances) < VERIFY_K:
+            return False, float(np.max(distances))
+        score = float(np.partition(distances, VERIFY_K - 1)[VERIFY_K - 1])
+    else:
+        score = float(np.min(distances))
+    return score < threshold, score
+
+async def cached_embedding(content: bytes, profile: FaceProfile) -> List[float]:
+    # Foto referensi jarang berubah, jadi embedding disimpan berdasarkan hash isi file
+    key = EmbeddingCache.make_key(content, profile.cache_namespace)
+
+    # I/O SQLite dijalankan di thread supaya event loop tidak menunggu disk
+    embedding = await asyncio.to_thread(embedding_cache.get, key)
+    if embedding is None:
+        embedding_cache_lookups.inc(result="miss")
+        embedding, _ = await upload_embedding(content, profile)
+        await asyncio.to_thread(embedding_cache.put, key, embedding)
+    else:
+        embedding_cache_lookups.inc(result="hit")
+    return embedding
+
+async def verify_enrolled(
+    index: int,
+    filename: str,
+    content: Union[bytes, HTTPException],
+    user_id: str,
+    profile: FaceProfile,
+    semaphore: asyncio.Semaphore
+) -> Dict:
+    # content berisi HTTPException kalau foto gagal dibaca (misalnya terlalu besar)
+    result = {"index": index, "user_id": user_id, "filename": filename}
+
+    ref_embeddings = await asyncio.to_thread(profile.index.embeddings_for, user_id)
+    if len(ref_embeddings) == 0:
+        result.update(status=404, detail="User belum terdaftar.")
+        return result
+    if len(ref_embeddings) < min_references():
+        result.update(status=400, detail=f"User baru punya {len(ref_embeddings)} foto terdaftar, minimal {min_references()}.")
+        return result
+
+    async with semaphore:
+        try:
+            if isinstance(content, HTTPException):
+                raise content
+            for attempt in range(1, BATCH_MAX_ATTEMPTS + 1):
+                try:
+                    # Admission per foto, request batch sendiri tidak memegang slot
+                    with admit_request():
+                        input_embedding, info = await upload_embedding(content, profile)
+                    break
+                except HTTPException as he:
+                    # Antrian inference penuh, tunggu lalu coba lagi
+                    if he.status_code != 503 or attempt == BATCH_MAX_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(INFERENCE_RETRY_AFTER)
+
+        except QualityRejected as qe:
+            result.update(status=qe.status_code, detail=qe.detail, quality=qe.quality)
+            return result
+
+        except HTTPException as he:
+            result.update(status=he.status_code, detail=he.detail)
+            return result
+
+        except Exception as e:
+            result.update(status=500, detail=f"Terjadi kesalahan: {str(e)}")
+            return result
+
+    with stage_duration.time(stage="distance"):
+        distances = cosine_distances(input_embedding, ref_embeddings)
+    if VERIFY_MODE == "all":
+        verified, score = aggregate_distances(distances, profile.threshold)
+    else:
+        # Putusan sama dengan loop early_exit /verify-face: jarak referensi pertama yang
+        # cocok, kalau tidak ada yang cocok jarak terkecil
+        matches = np.flatnonzero(distances < profile.threshold)
+        verified = len(matches) > 0
+        score = float(distances[matches[0]]) if verified else float(np.min(distances))
+
+    result.update(status=200, verified=verified, distance=score, **info)
+    if not verified:
+        result["detail"] = "Wajah tidak cocok"
+    return result
+
     
-@app.post("/check-face-presence")
-async def check_face_presence(image: UploadFile = File(...)):
-    filename = f"temp_{uuid4().hex}_{image.filename}"
-    
-    with open(filename, "wb") as f1:
-        shutil.copyfileobj(image.file, f1)
+@app.post("/check-face-presence", dependencies=[Depends(request_admission)])
+async def check_face_presence(
+    image: UploadFile = File(...),
+    profile: Optional[str] = Form(None)
+):
+    face_profile = resolve_profile("/check-face-presence", profile)
 
     try:
         # Validasi wajah pada kedua gambar
-        if not is_face_present(filename):
+        content = await read_upload(image)
+        if not await inference_pool.run(upload_has_face, content, face_profile):
             raise HTTPException(status_code=400, detail="Gambar tidak mengandung wajah.")
 
         return {
@@ -104,17 +589,18 @@ async def check_face_presence(image: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Terjadi kesalahan: {str(e)}")
 
-    finally:
-        # Hapus file sementara
-        os.remove(filename)
-        
-@app.post("/verify-face")
+
+@app.post("/verify-face", dependencies=[Depends(request_admission)])
 async def verify_face(
     photo: UploadFile = File(...),
-    references: List[UploadFile] = File(...)
+    references: List[UploadFile] = File(...),
+    profile: Optional[str] = Form(None)
 ):
-    input_path = save_upload(photo)
-    ref_paths = [save_upload(ref) for ref in references]
+    face_profile = resolve_profile("/verify-face", profile)
+    check_references(references)
+    if len(references) < min_references():
+        raise HTTPException(status_code=400, detail=f"Jumlah foto referensi minimal {min_references()}.")
+    input_content = await read_upload(photo)
 
     try:
         # Validasi wajah pada kedua gambar
@@ -124,20 +610,107 @@ async def verify_face(
         #     if not is_face_present(filename):
         #         raise HTTPException(status_code=400, detail="Foto profil user tidak mengandung wajah/tidak jelas.")
 
-        input_embedding = try_rotations_for_embedding(input_path)
+        if VERIFY_MODE == "all":
+            # Semua embedding dihitung bersamaan supaya masuk batch yang sama
+            ref_contents = [await read_upload(ref) for ref in references]
+            (input_embedding, info), *ref_embeddings = await asyncio.gather(
+                upload_embedding(input_content, face_profile),
+                *[cached_embedding(ref_content, face_profile) for ref_content in ref_contents]
+            )
+            with stage_duration.time(stage="distance"):
+                distances = cosine_distances(input_embedding, np.asarray(ref_embeddings))
+            verified, score = aggregate_distances(distances, face_profile.threshold)
+
+            result = {
+                "verified": verified,
+                "distance": score,
+                "distances": distances.tolist(),
+                **info,
+            }
+            if not verified:
+                result["detail"] = "Wajah tidak cocok"
+            return result
+
+        input_embedding, info = await upload_embedding(input_content, face_profile)
+        best_distance = None
+
+        # Referensi dibaca satu per satu, yang setelah referensi cocok tidak perlu dibaca
+        for ref in references:
+            ref_embedding = await cached_embedding(await read_upload(ref), face_profile)
+            with stage_duration.time(stage="distance"):
+                distance = cosine(input_embedding, ref_embedding)
+            if distance < face_profile.threshold:
+                return {"verified": True, "distance": distance, **info}
+            best_distance = distance if best_distance is None else min(best_distance, distance)
+
+        return {
+            "verified": False,
+            "distance": best_distance,
+            **info,
+            "detail": "Wajah tidak cocok",
+        }
+
+    except HTTPException as he:
+        raise he
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan: {str(e)}")
+
 
-        def process_reference(ref_path):
-            ref_embedding = try_rotations_for_embedding(ref_path)
-            dist = cosine(input_embedding, ref_embedding)
-            return dist, ref_path
+@app.post("/verify-batch")
+async def verify_batch(
+    photos: List[UploadFile] = File(...),
+    user_ids: List[str] = Form(...),
+    profile: Optional[str] = Form(None)
+):
+    # Pasangan photos[i] dan user_ids[i] dicocokkan dengan embedding user yang sudah enroll,
+    # hasil dikirim per baris NDJSON begitu selesai (urutan tidak dijamin, pakai "index")
+    if len(photos) != len(user_ids):
+        raise HTTPException(status_code=400, detail="Jumlah photos dan user_ids harus sama.")
+
+    face_profile = resolve_profile("/verify-batch", profile)
+    # Semua foto dibaca sebelum endpoint return. FastAPI < 0.118 menutup UploadFile begitu
+    # endpoint selesai, sebelum StreamingResponse selesai mengirim hasil
+    contents = []
+    for photo in photos:
+        try:
+            contents.append(await read_upload(photo))
+        except HTTPException as he:
+            contents.append(he)
 
-        results = map(process_reference, ref_paths)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.ensure_future(verify_enrolled(index, photo.filename, content, user_id, face_profile, semaphore))
+        for index, (photo, content, user_id) in enumerate(zip(photos, contents, user_ids))
+    ]
+
+    async def stream_results():
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
 
-        for distance, ref_path in results:
-            if distance < THRESHOLD:
-                return {"verified": True, "distance": distance}
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
-        return {"verified": False, "distance": distance, "detail": "Wajah tidak cocok"}
+
+@app.post("/enroll", dependencies=[Depends(request_admission)])
+async def enroll(
+    user_id: str = Form(...),
+    photos: List[UploadFile] = File(...),
+    profile: Optional[str] = Form(None)
+):
+    face_profile = resolve_profile("/enroll", profile)
+    check_references(photos)
+
+    try:
+        embeddings = [
+            await cached_embedding(await read_upload(photo), face_profile)
+            for photo in photos
+        ]
+        count = await asyncio.to_thread(face_profile.index.enroll, user_id, embeddings)
+        return {"user_id": user_id, "enrolled": count}
 
     except HTTPException as he:
         raise he
@@ -145,15 +718,76 @@ async def verify_face(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Terjadi kesalahan: {str(e)}")
 
-    finally:
-        # Hapus file sementara
-        os.remove(input_path)
-        for ref_path in ref_paths:
-            os.remove(ref_path)
+
+@app.delete("/enroll/{user_id}")
+async def unenroll(user_id: str, profile: Optional[str] = None):
+    removed = await asyncio.to_thread(resolve_profile("/enroll", profile).index.remove, user_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail="User belum terdaftar.")
+    return {"user_id": user_id, "removed": removed}
+
+
+@app.post("/identify", dependencies=[Depends(request_admission)])
+async def identify(
+    photo: UploadFile = File(...),
+    top_k: int = Form(5),
+    profile: Optional[str] = Form(None)
+):
+    face_profile = resolve_profile("/identify", profile)
+    if top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k minimal 1.")
+    top_k = min(top_k, MAX_TOP_K)
+
+    try:
+        input_embedding, info = await upload_embedding(await read_upload(photo), face_profile)
+        with stage_duration.time(stage="distance"):
+            candidates = await asyncio.to_thread(face_profile.index.search, input_embedding, top_k)
+
+        if candidates and candidates[0]["distance"] < face_profile.threshold:
+            best = candidates[0]
+            return {
+                "identified": True,
+                "user_id": best["user_id"],
+                "distance": best["distance"],
+                **info,
+                "candidates": candidates,
+            }
+
+        return {
+            "identified": False,
+            "candidates": candidates,
+            **info,
+            "detail": "Wajah tidak dikenali",
+        }
+
+    except HTTPException as he:
+        raise he
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan: {str(e)}")
+
+
+@app.get("/profiles")
+async def profiles():
+    return {
+        "profiles": {profile.name: profile.describe() for profile in model_registry.profiles()},
+        "endpoints": ENDPOINT_PROFILES,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_metrics()
 
 
 @app.get("/health")
-async def test():
+async def test(response: Response):
+    if not model_ready:
+        response.status_code = 503
+        return {
+            "status": "warming up"
+        }
+
     return {
         "status": "oke"
     }
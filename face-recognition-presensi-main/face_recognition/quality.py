@@ -0,0 +1,36 @@
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+
+class QualityGate:
+    """ Cek kualitas foto yang murah (blur, kecerahan, ukuran wajah) sebelum deteksi dan embedding """
+
+    def __init__(self, min_blur: float, min_brightness: float, max_brightness: float, min_face_size: int):
+        self.min_blur = min_blur
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_face_size = min_face_size
+
+    def image_scores(self, image: np.ndarray) -> Dict:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return {
+            # Variansi Laplacian rendah berarti hampir tidak ada tepi tajam
+            "blur": round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 2),
+            "brightness": round(float(gray.mean()), 2),
+        }
+
+    def image_problem(self, scores: Dict) -> Optional[str]:
+        if scores["brightness"] < self.min_brightness:
+            return "dark"
+        if scores["brightness"] > self.max_brightness:
+            return "bright"
+        if scores["blur"] < self.min_blur:
+            return "blur"
+        return None
+
+    def face_problem(self, face_size: int) -> Optional[str]:
+        if face_size < self.min_face_size:
+            return "small_face"
+        return None
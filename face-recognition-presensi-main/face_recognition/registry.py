@@ -0,0 +1,126 @@
+import multiprocessing
+import threading
+from functools import partial
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+from deepface import DeepFace
+
+from batcher import EmbeddingBatcher
+from face_index import FaceIndex
+from inference import InferencePool
+
+
+def _build_models(model_names: List[str]):
+    for model_name in model_names:
+        DeepFace.build_model(model_name=model_name)
+
+
+def preload_weights(model_names: Iterable[str]):
+    """ Unduh bobot model di proses spawn supaya proses pemanggil (master sebelum fork) tidak
+    pernah menginisialisasi TensorFlow """
+    process = multiprocessing.get_context("spawn").Process(target=_build_models, args=(sorted(model_names),))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Gagal mengunduh bobot model {sorted(model_names)} (exit code {process.exitcode})")
+
+
+class FaceProfile:
+    """ Pasangan model + detector (dan threshold-nya) yang bisa dipilih per endpoint/request """
+
+    def __init__(self, name: str, model_name: str, detector_backend: str, threshold: float, registry: "ModelRegistry"):
+        self.name = name
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.threshold = threshold
+        self._registry = registry
+
+    @property
+    def cache_namespace(self) -> str:
+        # Embedding bergantung pada model dan crop dari detector
+        return f"{self.model_name}/{self.detector_backend}"
+
+    def get_model(self):
+        return self._registry.get_model(self.model_name)
+
+    @property
+    def batcher(self) -> EmbeddingBatcher:
+        return self._registry.get_batcher(self.model_name)
+
+    @property
+    def index(self) -> FaceIndex:
+        return self._registry.get_index(self.model_name)
+
+    def describe(self) -> Dict:
+        return {
+            "model_name": self.model_name,
+            "detector_backend": self.detector_backend,
+            "threshold": self.threshold,
+        }
+
+
+class ModelRegistry:
+    """ Model dibangun sekali per nama model (lazy) dan dipakai bersama oleh semua profil """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[str, np.ndarray], np.ndarray],
+        pool: InferencePool,
+        index_path: str,
+        max_batch_size: int,
+        max_delay: float,
+    ):
+        self._embed_batch = embed_batch
+        self._pool = pool
+        self._index_path = index_path
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        # _lock hanya menjaga dict dan tidak pernah dipegang selama model dibangun. Tiap model
+        # punya lock build sendiri, jadi build satu model (bisa bermenit-menit) tidak menahan
+        # index, profil lain atau event loop
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._models: Dict[str, object] = {}
+        self._batchers: Dict[str, EmbeddingBatcher] = {}
+        self._indexes: Dict[str, FaceIndex] = {}
+        self._profiles: Dict[str, FaceProfile] = {}
+
+    def add_profile(self, name: str, model_name: str, detector_backend: str, threshold: float) -> FaceProfile:
+        profile = FaceProfile(name, model_name, detector_backend, threshold, self)
+        self._profiles[name] = profile
+        return profile
+
+    def profile(self, name: str) -> FaceProfile:
+        return self._profiles[name]
+
+    def profiles(self) -> List[FaceProfile]:
+        return list(self._profiles.values())
+
+    def get_model(self, model_name: str):
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+        with self._lock:
+            build_lock = self._build_locks.setdefault(model_name, threading.Lock())
+        with build_lock:
+            if model_name not in self._models:
+                self._models[model_name] = DeepFace.build_model(model_name=model_name)
+            return self._models[model_name]
+
+    def get_batcher(self, model_name: str) -> EmbeddingBatcher:
+        # Hanya dipanggil dari event loop, batch tidak boleh mencampur model berbeda
+        if model_name not in self._batchers:
+            self._batchers[model_name] = EmbeddingBatcher(
+                partial(self._embed_batch, model_name),
+                self._pool,
+                max_batch_size=self._max_batch_size,
+                max_delay=self._max_delay,
+            )
+        return self._batchers[model_name]
+
+    def get_index(self, model_name: str) -> FaceIndex:
+        with self._lock:
+            if model_name not in self._indexes:
+                self._indexes[model_name] = FaceIndex(self._index_path, model_name)
+            return self._indexes[model_name]